@@ -1,14 +1,27 @@
 import os
+import copy
 import json
 import glob
+import hashlib
+import sqlite3
 from binoculars import Binoculars
 from tqdm import tqdm
-import textwrap
-import ijson
+# Prefer the C yajl backend for ijson, falling back to slower backends if unavailable
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson.backends.yajl2_cffi as ijson
+    except ImportError:
+        import ijson
 import logging
 import sys
 from pathlib import Path
 import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
 
 # Set up logging
 logging.basicConfig(
@@ -20,101 +33,291 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Thresholds for prediction
+# Thresholds for prediction (calibrated on bfloat16 model weights)
 BINOCULARS_ACCURACY_THRESHOLD = 0.9015310749276843  # optimized for f1-score
 BINOCULARS_FPR_THRESHOLD = 0.8536432310785527  # optimized for low-fpr [chosen at 0.01%]
 
-def process_file_streaming(input_file, output_file, bino):
-    """Process a single JSON file using streaming and save to output location."""
+# Number of abstracts scored per Binoculars forward pass
+BATCH_SIZE = 32
+
+# Read size for streaming JSON input (1 MiB)
+READ_BUFFER_SIZE = 1 << 20
+
+# On-disk score cache shared across runs (scores depend on the Binoculars models,
+# so delete this file if the observer/performer models change)
+SCORE_CACHE_PATH = "binoculars_cache.db"
+CACHE_COMMIT_INTERVAL = 1000  # Cached scores written per SQLite commit
+
+# Representative input used to trigger model compilation before processing
+WARMUP_ABSTRACT = (
+    "In this paper, we propose a novel method for improving the efficiency of "
+    "deep neural networks and evaluate it on several benchmark datasets."
+)
+
+def binoculars_reduction(observer_logits, performer_logits, input_ids, attention_mask, pad_token_id):
+    """
+    Per-sequence Binoculars score from the two models' logits: the performer's
+    log-perplexity divided by the observer/performer cross-perplexity.
+    Mirrors binoculars.metrics.perplexity and entropy as plain tensor ops, so
+    torch.compile can fuse the vocabulary reductions instead of materializing
+    the full (batch, seq, vocab) softmax. The masked means are taken in the
+    logits dtype and only then cast to float32, exactly as the library does, so
+    scores stay comparable with its thresholds.
+    """
+    # Log-perplexity of the text under the performer model
+    shifted_logits = performer_logits[..., :-1, :]
+    shifted_labels = input_ids[..., 1:]
+    shifted_mask = attention_mask[..., 1:]
+    nll = F.cross_entropy(shifted_logits.transpose(1, 2), shifted_labels, reduction="none")
+    ppl = ((nll * shifted_mask).sum(1) / shifted_mask.sum(1)).float()
+    
+    # Cross-perplexity of the observer's next-token distribution against the performer's
+    observer_proba = torch.softmax(observer_logits, dim=-1)
+    x_ce = -(observer_proba * torch.log_softmax(performer_logits, dim=-1)).sum(-1)
+    padding_mask = (input_ids != pad_token_id).type(torch.uint8)
+    x_ppl = ((x_ce * padding_mask).sum(1) / padding_mask.sum(1)).float()
+    
+    return ppl / x_ppl
+
+# Replaced by a compiled version in compile_models()
+score_reduction = binoculars_reduction
+
+def compute_score_batch(bino, abstracts):
+    """
+    Score a list of abstracts with one padded forward pass per model.
+    Pad tokens are masked out of both perplexities, as in Binoculars.compute_score.
+    """
+    encodings = bino._tokenize(abstracts)
+    observer_logits, performer_logits = bino._get_logits(encodings)
+    device = observer_logits.device
+    encodings = encodings.to(device)
+    with torch.inference_mode():
+        scores = score_reduction(observer_logits, performer_logits.to(device),
+                                 encodings.input_ids, encodings.attention_mask,
+                                 bino.tokenizer.pad_token_id)
+    return scores.float().cpu().tolist()
+
+def compile_models(bino):
+    """
+    Compile the observer and performer models and the score reduction with
+    torch.compile and warm them up, so compilation happens before the file loop.
+    Falls back to eager mode on failure.
+    """
+    global score_reduction
+    if not hasattr(torch, "compile"):
+        logger.warning("torch.compile is not available, running models uncompiled.")
+        return
+    
+    observer_model, performer_model = bino.observer_model, bino.performer_model
     try:
-        logger.info(f"Processing file: {input_file}")
+        start_time = time.time()
+        # dynamic=True avoids recompiling for every padded batch length
+        bino.observer_model = torch.compile(observer_model, dynamic=True)
+        bino.performer_model = torch.compile(performer_model, dynamic=True)
+        score_reduction = torch.compile(binoculars_reduction, mode="max-autotune", dynamic=True)
+        compute_score_batch(bino, [WARMUP_ABSTRACT] * BATCH_SIZE)
+        logger.info(f"Models compiled in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.warning(f"torch.compile failed, running models uncompiled: {e}")
+        bino.observer_model, bino.performer_model = observer_model, performer_model
+        score_reduction = binoculars_reduction
+
+def abstract_key(abstract):
+    """Cache key for an abstract. The exact text is hashed, since any whitespace change alters its tokens."""
+    return hashlib.blake2b(abstract.encode('utf-8'), digest_size=16).digest()
+
+class ScoreCache:
+    """
+    Scores keyed by abstract_key, held in memory and persisted to SQLite so
+    repeat runs skip abstracts scored before. Writes are committed in batches.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, score REAL)")
+        self.scores = dict(self.conn.execute("SELECT key, score FROM scores"))
+        self.uncommitted = 0
+        logger.info(f"Loaded {len(self.scores)} cached scores from {path}")
+    
+    def __contains__(self, key):
+        return key in self.scores
+    
+    def __getitem__(self, key):
+        return self.scores[key]
+    
+    def __setitem__(self, key, score):
+        self.scores[key] = score
+        self.conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?)", (key, score))
+        self.uncommitted += 1
+        if self.uncommitted >= CACHE_COMMIT_INTERVAL:
+            self.commit()
+    
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+    
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def predict(scores):
+    """
+    Apply both thresholds to an array of scores at once.
+    Returns int8 (accuracy, fpr) prediction arrays: 0 for Human, 1 for AI.
+    """
+    accuracy_predictions = np.where(scores >= BINOCULARS_ACCURACY_THRESHOLD, 0, 1).astype(np.int8)
+    fpr_predictions = np.where(scores >= BINOCULARS_FPR_THRESHOLD, 0, 1).astype(np.int8)
+    return accuracy_predictions, fpr_predictions
+
+def score_batch(batch, bino, score_cache, ids, scores):
+    """
+    Score a batch of (scopus_id, title, abstract) tuples, appending to ids and scores.
+    Abstracts already in score_cache (duplicates within or across files) are not rescored.
+    """
+    keys = [abstract_key(abstract) for _, _, abstract in batch]
+    
+    # Collect each abstract that has not been scored yet, once
+    misses = {}
+    for key, (scopus_id, _, abstract) in zip(keys, batch):
+        if key not in score_cache and key not in misses:
+            misses[key] = (scopus_id, abstract)
+    
+    if misses:
+        try:
+            new_scores = compute_score_batch(bino, [abstract for _, abstract in misses.values()])
+        except Exception as e:
+            # Fall back to one-at-a-time scoring so a single bad abstract does not drop the batch
+            logger.error(f"Error processing batch of {len(misses)} abstracts, retrying individually: {e}")
+            new_scores = []
+            for scopus_id, abstract in misses.values():
+                try:
+                    new_scores.append(bino.compute_score(abstract))
+                except Exception as e:
+                    logger.error(f"Error processing abstract for {scopus_id or 'N/A'}: {e}")
+                    new_scores.append(None)
+        for key, score in zip(misses, new_scores):
+            if score is not None:
+                score_cache[key] = score
+    
+    scored = [(item, score_cache[key]) for item, key in zip(batch, keys) if key in score_cache]
+    batch_scores = np.array([score for _, score in scored], dtype=np.float64)
+    accuracy_predictions, fpr_predictions = predict(batch_scores)
+    for (scopus_id, _, _), score in scored:
+        ids.append(scopus_id)
+        scores.append(score)
+    
+    logger.info(f"Scored {len(scored)}/{len(batch)} abstracts ({len(misses)} new, "
+                f"{int(accuracy_predictions.sum())} AI-generated by accuracy threshold)")
+    
+    # Print abstracts and results to console (debug runs only)
+    if logger.isEnabledFor(logging.DEBUG):
+        for ((scopus_id, title, abstract), score), accuracy_prediction, fpr_prediction in zip(
+                scored, accuracy_predictions, fpr_predictions):
+            logger.debug("\n" + "="*80)
+            logger.debug(f"Title: {title}")
+            logger.debug(f"ID: {scopus_id or 'N/A'}")
+            logger.debug("\nAbstract:")
+            logger.debug(abstract[:200] + ("…" if len(abstract) > 200 else ""))
+            logger.debug("\nResults:")
+            logger.debug(f"Binoculars Score: {score:.6f}")
+            logger.debug(f"Accuracy Prediction: {'Human (0)' if accuracy_prediction == 0 else 'AI-Generated (1)'}")
+            logger.debug(f"FPR Prediction: {'Human (0)' if fpr_prediction == 0 else 'AI-Generated (1)'}")
+            logger.debug("="*80)
+
+def write_scored_articles(input_file, out, results):
+    """Stream articles from input_file into out as a JSON array, patching in new scores."""
+    ids, scores, accuracy_predictions, fpr_predictions = results
+    id_to_index = {scopus_id: i for i, scopus_id in enumerate(ids)}
+    
+    out.write("[\n")
+    with open(input_file, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        for i, article in enumerate(ijson.items(f, 'item', use_float=True, buf_size=READ_BUFFER_SIZE)):
+            idx = id_to_index.get(article.get('Scopus_ID'))
+            if idx is not None:
+                article['Binoculars_Score'] = float(scores[idx])
+                article['Accuracy_Prediction'] = int(accuracy_predictions[idx])
+                article['FPR_Prediction'] = int(fpr_predictions[idx])
+            if i:
+                out.write(",\n")
+            json.dump(article, out, ensure_ascii=False)
+    out.write("\n]\n")
+
+def needs_score(article):
+    """Return True if the article has a usable abstract but no Binoculars score yet."""
+    # Skip if the article already has a Binoculars score
+    if article.get("Binoculars_Score") is not None:
+        return False
+    
+    # Skip if abstract is empty or N/A
+    abstract = article.get("Abstract", "")
+    return bool(abstract) and abstract != "N/A"
+
+def read_unscored_abstracts(input_file, tokenizer):
+    """
+    Stream a JSON file and collect (n_tokens, scopus_id, title, abstract) for every
+    article that still needs a score, sorted by token length. An empty list means
+    the file is already fully scored. Returns None on error.
+    """
+    try:
+        logger.info(f"Reading file: {input_file}")
         file_size = os.path.getsize(input_file)
         logger.info(f"File size: {file_size / (1024*1024):.2f} MB")
         
-        # First pass: Process items and collect scores
-        start_time = time.time()
-        processed_items = []
-        
-        with open(input_file, 'rb') as f:
-            items = ijson.items(f, 'item')
-            for article in tqdm(items, desc="Processing articles"):
-                # Skip if the article already has a Binoculars score
-                if "Binoculars_Score" in article and article["Binoculars_Score"] is not None:
-                    continue
-                
-                abstract = article.get("Abstract", "")
-                
-                # Skip if abstract is empty or N/A
-                if not abstract or abstract == "N/A":
+        pending = []
+        with open(input_file, 'rb', buffering=READ_BUFFER_SIZE) as f:
+            items = ijson.items(f, 'item', buf_size=READ_BUFFER_SIZE)
+            for article in items:
+                if not needs_score(article):
                     continue
                 
-                # Compute the Binoculars score
-                try:
-                    score = bino.compute_score(abstract)
-                    
-                    # Determine predictions based on thresholds (0 for Human, 1 for AI)
-                    accuracy_prediction = 0 if score >= BINOCULARS_ACCURACY_THRESHOLD else 1
-                    fpr_prediction = 0 if score >= BINOCULARS_FPR_THRESHOLD else 1
-                    
-                    # Store the processed item
-                    processed_item = {
-                        'Scopus_ID': article.get('Scopus_ID', ''),
-                        'Binoculars_Score': score,
-                        'Accuracy_Prediction': accuracy_prediction,
-                        'FPR_Prediction': fpr_prediction
-                    }
-                    processed_items.append(processed_item)
-                    
-                    # Print abstract and results to console
-                    logger.info("\n" + "="*80)
-                    logger.info(f"Title: {article.get('Title', 'N/A')}")
-                    logger.info(f"ID: {article.get('Scopus_ID', 'N/A')}")
-                    
-                    # Print wrapped abstract for readability
-                    logger.info("\nAbstract:")
-                    wrapped_abstract = textwrap.fill(abstract, width=80)
-                    logger.info(wrapped_abstract)
-                    
-                    # Print scores and predictions
-                    logger.info("\nResults:")
-                    logger.info(f"Binoculars Score: {score:.6f}")
-                    logger.info(f"Accuracy Prediction: {'Human (0)' if accuracy_prediction == 0 else 'AI-Generated (1)'}")
-                    logger.info(f"FPR Prediction: {'Human (0)' if fpr_prediction == 0 else 'AI-Generated (1)'}")
-                    logger.info("="*80)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing abstract for {article.get('Scopus_ID', 'N/A')}: {e}")
-        
-        process_time = time.time() - start_time
-        logger.info(f"Processing completed in {process_time:.2f} seconds")
-        logger.info(f"Processed {len(processed_items)} items")
+                abstract = article["Abstract"]
+                n_tokens = len(tokenizer.encode(abstract, add_special_tokens=False))
+                pending.append((n_tokens, article.get('Scopus_ID', ''), article.get('Title', 'N/A'), abstract))
         
-        if not processed_items:
-            logger.warning("No items were processed.")
+        # Sort by token length so each batch pads to a similar length
+        pending.sort(key=lambda item: item[0])
+        return pending
+    
+    except Exception as e:
+        logger.error(f"Error reading file {input_file}: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+
+def score_abstracts(pending, bino, score_cache):
+    """
+    Score length-sorted abstracts in batches. Returns parallel (ids, scores,
+    accuracy_predictions, fpr_predictions), with predictions 0 for Human and 1 for AI.
+    """
+    start_time = time.time()
+    ids, score_list = [], []
+    for i in tqdm(range(0, len(pending), BATCH_SIZE), desc="Scoring batches"):
+        batch = [item[1:] for item in pending[i:i + BATCH_SIZE]]
+        score_batch(batch, bino, score_cache, ids, score_list)
+    
+    scores = np.array(score_list, dtype=np.float64)
+    accuracy_predictions, fpr_predictions = predict(scores)
+    
+    process_time = time.time() - start_time
+    logger.info(f"Processing completed in {process_time:.2f} seconds")
+    logger.info(f"Processed {len(ids)} items")
+    return ids, scores, accuracy_predictions, fpr_predictions
+
+def save_scored_file(input_file, output_file, results):
+    """Write the input file with new scores patched in. Returns True on success."""
+    try:
+        if not results[0]:
+            logger.warning(f"No items were processed for {input_file}.")
             return False
         
-        # Write to new file
+        # Second pass: stream the original articles into the new file
         start_time = time.time()
         
-        # Read original file
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        # Update scores in the original data
-        scores_dict = {item['Scopus_ID']: item for item in processed_items}
-        for article in data:
-            if article.get('Scopus_ID') in scores_dict:
-                scores = scores_dict[article['Scopus_ID']]
-                article['Binoculars_Score'] = scores['Binoculars_Score']
-                article['Accuracy_Prediction'] = scores['Accuracy_Prediction']
-                article['FPR_Prediction'] = scores['FPR_Prediction']
-        
         # Create output directory if it doesn't exist
         output_file.parent.mkdir(parents=True, exist_ok=True)
         
         # Write updated data to new file
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+            write_scored_articles(input_file, f, results)
         
         write_time = time.time() - start_time
         logger.info(f"File saved to {output_file} in {write_time:.2f} seconds")
@@ -132,8 +335,12 @@ def analyze_abstracts():
     Analyze abstracts from specified JSON files using the Binoculars LLM detector,
     and save processed files to data/comp-proc directory.
     """
-    # Initialize Binoculars
-    bino = Binoculars()
+    # Initialize Binoculars with bfloat16 weights to match the thresholds
+    bino = Binoculars(use_bfloat16=True)
+    compile_models(bino)
+    
+    # Scores keyed by abstract, shared across files and runs so duplicates are scored once
+    score_cache = ScoreCache(SCORE_CACHE_PATH)
     
     # Files to process
     target_files = [
@@ -157,7 +364,8 @@ def analyze_abstracts():
     input_dir = Path("data/comp/pre")
     output_dir = Path("data/comp-proc")
     
-    success_count = 0
+    # Resolve the files to process up front
+    files = []
     for file_path in target_files:
         input_file = input_dir / file_path
         output_file = output_dir / file_path
@@ -165,10 +373,44 @@ def analyze_abstracts():
         if not input_file.exists():
             logger.error(f"Input file not found: {input_file}")
             continue
-        
-        logger.info(f"\nProcessing: {file_path}")
-        if process_file_streaming(input_file, output_file, bino):
-            success_count += 1
+        files.append((input_file, output_file))
+    
+    # Pipeline the files: while the main thread scores one file on the GPU, a worker
+    # reads the next file and another writes out the previous one. Scoring stays on
+    # the main thread because the CUDA context belongs to it. The reader gets its own
+    # tokenizer: a fast tokenizer is not safe to share, as every call resets its
+    # truncation/padding state and concurrent calls fail with "Already borrowed".
+    reader_tokenizer = copy.deepcopy(bino.tokenizer)
+    success_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            next_read = executor.submit(read_unscored_abstracts, files[0][0], reader_tokenizer) if files else None
+            previous_write = None
+            for i, (input_file, output_file) in enumerate(files):
+                pending = next_read.result()
+                if i + 1 < len(files):
+                    next_read = executor.submit(read_unscored_abstracts, files[i + 1][0], reader_tokenizer)
+                
+                results = None
+                if pending:
+                    logger.info(f"\nProcessing: {input_file}")
+                    results = score_abstracts(pending, bino, score_cache)
+                elif pending is not None:
+                    logger.info(f"\n{input_file} already processed, skipping.")
+                    success_count += 1
+                
+                # Wait for the previous file's write before queueing this one
+                if previous_write is not None and previous_write.result():
+                    success_count += 1
+                previous_write = None
+                if results is not None:
+                    previous_write = executor.submit(save_scored_file, input_file, output_file, results)
+            
+            if previous_write is not None and previous_write.result():
+                success_count += 1
+    finally:
+        # Persist any scores not yet committed
+        score_cache.close()
     
     logger.info(f"\nProcessing completed:")
     logger.info(f"Successfully processed {success_count} out of {len(target_files)} files")
@@ -1,11 +1,17 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
 import time
 import random
 import glob
-import sys
-import select
+import signal
+import sqlite3
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
@@ -22,42 +28,146 @@ if api_keys_str:
 else:
     API_KEYS = [os.getenv("SCOPUS_API_KEY")]
 
-# Global pointer for current API key
+# Global pointer for current API key (guarded by api_key_lock, as fetches run in threads)
 current_api_key_index = 0
+api_key_lock = threading.Lock()
 
-def get_headers():
+def build_headers():
     return {
         "X-ELS-APIKey": API_KEYS[current_api_key_index],
-        "Accept": "application/json"
+        "Accept": "application/json",
+        "Connection": "keep-alive"
     }
 
-def cycle_api_key():
-    global current_api_key_index
-    current_api_key_index = (current_api_key_index + 1) % len(API_KEYS)
-    print(f"Cycling to API key index {current_api_key_index}: {API_KEYS[current_api_key_index]}")
+# Rebuilt only when the key changes; the dict is replaced, never mutated,
+# so threads can read it without the lock
+CURRENT_HEADERS = build_headers()
+
+def get_headers():
+    return CURRENT_HEADERS
+
+def cycle_api_key(failed_key=None):
+    global current_api_key_index, CURRENT_HEADERS
+    with api_key_lock:
+        # Another thread may already have cycled away from the key that failed
+        if failed_key is not None and failed_key != API_KEYS[current_api_key_index]:
+            return
+        current_api_key_index = (current_api_key_index + 1) % len(API_KEYS)
+        CURRENT_HEADERS = build_headers()
+        print(f"Cycling to API key index {current_api_key_index}: {API_KEYS[current_api_key_index]}")
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls at least 1/rate seconds apart. The rate
+    adapts AIMD-style: it grows by one request/s after a run of successes (while
+    latency is not climbing) and halves whenever the server answers 429.
+    strikes counts the key's 429s since its last success.
+    """
+    def __init__(self, rate, max_rate):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.next_time = 0.0
+        self.successes = 0
+        self.strikes = 0
+        self.ewma_latency = None
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + 1.0 / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+    def record_success(self, latency):
+        with self.lock:
+            # Only probe for more throughput while the server is not slowing down
+            steady = self.ewma_latency is None or latency <= 1.5 * self.ewma_latency
+            self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+            self.successes += 1
+            self.strikes = 0
+            if self.successes >= AIMD_SUCCESS_WINDOW and steady:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self.successes = 0
+
+    def record_rate_limited(self, delay):
+        with self.lock:
+            self.rate = max(MIN_RATE_PER_KEY, self.rate / 2)
+            self.successes = 0
+            self.strikes += 1
+            # Hold back every request on this key until the server is ready again
+            self.next_time = max(self.next_time, time.monotonic() + delay)
+            return self.strikes
+
+INITIAL_RATE_PER_KEY = 4  # Starting requests per second for each API key
+MAX_RATE_PER_KEY = 9  # Requests per second allowed for each API key
+MIN_RATE_PER_KEY = 0.5
+AIMD_SUCCESS_WINDOW = 20  # Consecutive successes before raising a key's rate
+DEFAULT_RETRY_DELAY = 2  # Base seconds of exponential backoff after a 429 without a usable server hint
+MAX_RETRY_DELAY = 60
+RETRY_JITTER = 1  # Up to this many random seconds are added so threads do not retry in lockstep
+KEY_EXHAUSTED_STRIKES = 3  # 429s in a row after which a key is treated as out of quota
+rate_limiters = {}
+
+def get_rate_limiter(api_key):
+    """Return the adaptive rate limiter for the given API key."""
+    with api_key_lock:
+        return rate_limiters.setdefault(api_key, RateLimiter(INITIAL_RATE_PER_KEY, MAX_RATE_PER_KEY))
+
+def retry_delay(response, strikes=0):
+    """
+    Seconds to wait after a 429, taken from Retry-After or X-RateLimit-Reset when
+    present, otherwise exponential in the key's recent 429s plus jitter.
+    """
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(int(retry_after), MAX_RETRY_DELAY)
+    reset = response.headers.get("X-RateLimit-Reset", "")
+    if reset.isdigit() and 0 < int(reset) - time.time() <= MAX_RETRY_DELAY:
+        return int(reset) - time.time()
+    return min(MAX_RETRY_DELAY, DEFAULT_RETRY_DELAY * 2 ** strikes) + random.uniform(0, RETRY_JITTER)
+
+def handle_rate_limit(api_key, limiter, response):
+    """
+    Back the key off after a 429. The key is only cycled out once it looks out of
+    quota (the server reports none remaining, or it keeps answering 429); a briefly
+    throttled key is still productive once the backoff has passed.
+    """
+    strikes = limiter.record_rate_limited(retry_delay(response, limiter.strikes))
+    if response.headers.get("X-RateLimit-Remaining") == "0" or strikes >= KEY_EXHAUSTED_STRIKES:
+        cycle_api_key(api_key)
+
+# Pausing is requested with SIGUSR1 (`kill -USR1 <pid>`) instead of polling stdin,
+# so checking for a pause costs nothing while running.
+pause_requested = False
+
+def request_pause(signum, frame):
+    global pause_requested
+    pause_requested = True
+
+signal.signal(signal.SIGUSR1, request_pause)
+print(f"Send SIGUSR1 to pause: kill -USR1 {os.getpid()}")
 
 def check_for_pause():
-    # Non-blocking check for user input on stdin.
-    # If the user types 'P' (or 'p') and presses Enter, return True.
-    rlist, _, _ = select.select([sys.stdin], [], [], 0.1)
-    if rlist:
-        line = sys.stdin.readline().strip()
-        if line.lower() == 'p':
-            return True
-    return False
+    return pause_requested
 
 def pause_and_reload():
-    print("Pausing execution. Add new API keys to the .env file and press 'P' again to resume.")
-    while True:
-        if check_for_pause():
-            break
+    global pause_requested
+    pause_requested = False
+    print(f"Pausing execution. Add new API keys to the .env file and run 'kill -USR1 {os.getpid()}' again to resume.")
+    while not pause_requested:
         time.sleep(1)
+    pause_requested = False
     print("Resuming execution. Reloading API keys from .env.")
     load_dotenv()
     new_keys_str = os.getenv("SCOPUS_API_KEYS")
     if new_keys_str:
-        global API_KEYS
-        API_KEYS = [key.strip() for key in new_keys_str.split(",")]
+        global API_KEYS, current_api_key_index, CURRENT_HEADERS
+        with api_key_lock:
+            API_KEYS = [key.strip() for key in new_keys_str.split(",")]
+            current_api_key_index = 0
+            CURRENT_HEADERS = build_headers()
         print(f"New API keys loaded: {API_KEYS}")
 
 # ==============================
@@ -66,80 +176,246 @@ def pause_and_reload():
 SEARCH_URL = "https://api.elsevier.com/content/search/scopus"
 ABSTRACT_URL = "https://api.elsevier.com/content/abstract/scopus_id/"
 COUNT = 200  # Articles per API call set to 200
+SCOPUS_ID_PREFIX = "SCOPUS_ID:"  # Prefix on dc:identifier values in search results
+# (output field, Scopus field) pairs copied straight from a record, defaulting to "N/A"
+CORE_FIELDS = (
+    ("Title", "dc:title"),
+    ("Abstract", "dc:description"),
+    ("Publication_Date", "prism:coverDate"),
+    ("DOI", "prism:doi"),
+    ("Source", "prism:publicationName")
+)
+# Abstract retrieval returns only the fields fetch_metadata reads, instead of the full record
+ABSTRACT_FIELDS = ",".join([key for _, key in CORE_FIELDS] + ["citedby-count", "authkeywords", "authors", "affiliation"])
+METADATA_BATCH_SIZE = 25  # IDs per OR-joined metadata search (the COMPLETE view's page limit)
+
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) timeouts in seconds
+
+# Articles within a search page are fetched concurrently by this pool
+FETCH_WORKERS = 16
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+# Shared session so every Scopus request reuses pooled keep-alive connections;
+# the pool keeps one connection per fetch worker plus headroom for the search loop
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=2 * FETCH_WORKERS, max_retries=0))
+
+# ==============================
+# 🔹 Local Metadata Cache
+# ==============================
+# Metadata already fetched once is served from disk, so resumed or crashed
+# runs skip the API round trip for every article they have seen before.
+METADATA_CACHE_PATH = "data/comp/cache.sqlite"
+CACHE_COMMIT_INTERVAL = 100  # Records buffered in memory per SQLite write
+CACHE_BUSY_TIMEOUT = 30  # Seconds to wait while another process is writing to the cache
+
+os.makedirs(os.path.dirname(METADATA_CACHE_PATH), exist_ok=True)
+
+def open_metadata_cache():
+    """Open a connection to the cache (each process needs its own)."""
+    # Autocommit mode, so no implicit transaction is held open between writes
+    conn = sqlite3.connect(METADATA_CACHE_PATH, timeout=CACHE_BUSY_TIMEOUT,
+                           check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (scopus_id TEXT PRIMARY KEY, json BLOB)")
+    return conn
+
+metadata_cache = open_metadata_cache()
+cache_lock = threading.Lock()  # Fetch workers share the one connection
+pending_cache_rows = {}  # scopus_id -> serialized metadata not yet written
+
+def get_cached_metadata(scopus_id):
+    """Return the cached metadata for scopus_id, or None if it was never fetched."""
+    with cache_lock:
+        blob = pending_cache_rows.get(scopus_id)
+        if blob is None:
+            row = metadata_cache.execute("SELECT json FROM meta WHERE scopus_id = ?", (scopus_id,)).fetchone()
+            blob = row[0] if row else None
+    return orjson.loads(blob) if blob is not None else None
+
+def flush_metadata_cache():
+    """
+    Write the buffered records in one short transaction (caller holds cache_lock), so
+    other processes sharing the cache are only locked out for the write itself. A failed
+    write is reported and the records are kept for the next flush, since the cache is
+    only an optimization.
+    """
+    if not pending_cache_rows:
+        return
+    try:
+        metadata_cache.execute("BEGIN IMMEDIATE")
+        metadata_cache.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", pending_cache_rows.items())
+        metadata_cache.execute("COMMIT")
+        pending_cache_rows.clear()
+    except sqlite3.OperationalError as e:
+        print(f"Metadata cache write failed, keeping {len(pending_cache_rows)} records for the next flush: {e}")
+        if metadata_cache.in_transaction:
+            metadata_cache.execute("ROLLBACK")
+
+def cache_metadata(scopus_id, metadata):
+    """Store fetched metadata, writing to disk once every CACHE_COMMIT_INTERVAL records."""
+    with cache_lock:
+        pending_cache_rows[scopus_id] = orjson.dumps(metadata)
+        if len(pending_cache_rows) >= CACHE_COMMIT_INTERVAL:
+            flush_metadata_cache()
+
+def close_metadata_cache():
+    """Write any buffered records and close the cache."""
+    with cache_lock:
+        flush_metadata_cache()
+        metadata_cache.close()
+
+atexit.register(close_metadata_cache)
 
 # ==============================
 # 🔹 Functions to Fetch Data
 # ==============================
-def fetch_metadata(scopus_id, retries=3):
-    """Retrieve full metadata including abstract and affiliations safely."""
-    for attempt in range(retries):
-        print(f"Fetching metadata for {scopus_id} (attempt {attempt+1})...")
-        response = requests.get(f"{ABSTRACT_URL}{scopus_id}", headers=get_headers())
-        if response.status_code == 429:
-            print(f"Rate limit hit for {scopus_id}. Cycling API key...")
-            cycle_api_key()
-            time.sleep(2)
-            continue
+def scopus_get(url, params=None, required_key=None, retries=3, description="request"):
+    """
+    GET a Scopus endpoint with rate limiting, 429 backoff and retries.
+    Returns the parsed JSON (checked to contain required_key, if given),
+    or None once every attempt has failed. A 429 does not use up an attempt:
+    the request waits out the backoff and handle_rate_limit cycles the key
+    once it is exhausted. It gives up once enough 429s have been seen for
+    every key to have been cycled out, or when a pause is requested, so the
+    page can finish and the pause can load new keys.
+    """
+    attempt = 0
+    rate_limited = 0
+    while attempt < retries:
+        if check_for_pause():
+            print(f"Pause requested, abandoning {description}.")
+            return None
+        headers = get_headers()
+        limiter = get_rate_limiter(headers["X-ELS-APIKey"])
+        limiter.wait()
+        start_time = time.monotonic()
         try:
-            json_data = response.json()
-        except Exception as e:
-            print(f"Error parsing JSON for {scopus_id}: {e}")
-            cycle_api_key()
+            response = SESSION.get(url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Request error for {description}: {e}")
+            attempt += 1
             time.sleep(2)
             continue
-        if not json_data or "abstracts-retrieval-response" not in json_data:
-            print(f"Error: No abstracts-retrieval-response found for {scopus_id}")
-            cycle_api_key()
-            time.sleep(2)
-            continue
-        data = json_data["abstracts-retrieval-response"]
-        core_data = data.get("coredata", {})
-        authors_section = data.get("authors") or {}
-        authors = authors_section.get("author", [])
-        affiliations = data.get("affiliation", [])
-        if not isinstance(affiliations, list):
-            affiliations = [affiliations] if affiliations else []
-        affiliation_name = affiliations[0].get("affiliation-name", "N/A") if affiliations else "N/A"
-        affiliation_country = affiliations[0].get("affiliation-country", "N/A") if affiliations else "N/A"
-        return {
-            "Scopus_ID": scopus_id,
-            "Title": core_data.get("dc:title", "N/A"),
-            "Abstract": core_data.get("dc:description", "N/A"),
-            "Authors": [author.get("ce:indexed-name", "N/A") for author in authors] if isinstance(authors, list) else [],
-            "Affiliation_Name": affiliation_name,
-            "Affiliation_Country": affiliation_country,
-            "Publication_Date": core_data.get("prism:coverDate", "N/A"),
-            "DOI": core_data.get("prism:doi", "N/A"),
-            "Keywords": core_data.get("authkeywords", "N/A"),
-            "Cited_By_Count": int(core_data.get("citedby-count", 0)),
-            "Source": core_data.get("prism:publicationName", "N/A")
-        }
-    return None
-
-def fetch_abstract(scopus_id, retries=3):
-    """Retrieve the abstract for a given article."""
-    for attempt in range(retries):
-        response = requests.get(f"{ABSTRACT_URL}{scopus_id}", headers=get_headers())
         if response.status_code == 429:
-            print(f"Rate limit hit for abstract {scopus_id}. Cycling API key...")
-            cycle_api_key()
-            time.sleep(2)
+            print(f"Rate limit hit for {description}. Backing off...")
+            handle_rate_limit(headers["X-ELS-APIKey"], limiter, response)
+            rate_limited += 1
+            if rate_limited >= KEY_EXHAUSTED_STRIKES * len(API_KEYS):
+                print(f"All API keys appear exhausted, giving up on {description}. "
+                      f"Add keys to .env and send SIGUSR1 (kill -USR1 {os.getpid()}) to reload them.")
+                return None
             continue
+        # Error responses say nothing about how fast the key can safely go
+        if response.status_code == 200:
+            limiter.record_success(time.monotonic() - start_time)
         try:
-            json_data = response.json()
+            json_data = orjson.loads(response.content)
         except Exception as e:
-            print(f"Error parsing JSON for abstract of {scopus_id}: {e}")
-            cycle_api_key()
+            print(f"Error parsing JSON for {description}: {e}")
+            attempt += 1
+            cycle_api_key(headers["X-ELS-APIKey"])
             time.sleep(2)
             continue
-        if not json_data or "abstracts-retrieval-response" not in json_data:
-            print(f"Error: No abstracts-retrieval-response found for abstract of {scopus_id}")
-            cycle_api_key()
+        if not json_data or (required_key and required_key not in json_data):
+            print(f"Error: No {required_key} found for {description}")
+            attempt += 1
+            cycle_api_key(headers["X-ELS-APIKey"])
             time.sleep(2)
             continue
-        data = json_data["abstracts-retrieval-response"]
-        return data.get("coredata", {}).get("dc:description", "N/A")
-    return "N/A"
+        return json_data
+    return None
+
+def first_affiliation(affiliations):
+    """(name, country) of the first affiliation; both endpoints use the same keys for these."""
+    if not isinstance(affiliations, list):
+        affiliations = [affiliations] if affiliations else []
+    if not affiliations:
+        return "N/A", "N/A"
+    return affiliations[0].get("affilname", "N/A"), affiliations[0].get("affiliation-country", "N/A")
+
+def fetch_metadata(scopus_id, retries=3):
+    """Retrieve full metadata including abstract and affiliations safely."""
+    cached = get_cached_metadata(scopus_id)
+    if cached is not None:
+        return cached
+    print(f"Fetching metadata for {scopus_id}...")
+    json_data = scopus_get(f"{ABSTRACT_URL}{scopus_id}", {"field": ABSTRACT_FIELDS},
+                           required_key="abstracts-retrieval-response", retries=retries, description=scopus_id)
+    if json_data is None:
+        return None
+    data = json_data["abstracts-retrieval-response"]
+    core_data = data.get("coredata", {})
+    authors_section = data.get("authors") or {}
+    authors = authors_section.get("author", [])
+    # Author keywords sit outside coredata here, as a list rather than search's joined string
+    keywords = (data.get("authkeywords") or {}).get("author-keyword", [])
+    if not isinstance(keywords, list):
+        keywords = [keywords]
+    affiliation_name, affiliation_country = first_affiliation(data.get("affiliation", []))
+    metadata = {field: core_data.get(key, "N/A") for field, key in CORE_FIELDS}
+    metadata.update({
+        "Scopus_ID": scopus_id,
+        # ce:indexed-name holds the same "Surname I." form as search's authname
+        "Authors": [author.get("ce:indexed-name", "N/A") for author in authors] if isinstance(authors, list) else [],
+        "Keywords": " | ".join(keyword.get("$", "") for keyword in keywords) if keywords else "N/A",
+        "Affiliation_Name": affiliation_name,
+        "Affiliation_Country": affiliation_country,
+        "Cited_By_Count": int(core_data.get("citedby-count", 0))
+    })
+    cache_metadata(scopus_id, metadata)
+    return metadata
+
+def parse_search_entry(scopus_id, entry):
+    """Map a COMPLETE-view search entry onto the same fields and values fetch_metadata returns."""
+    authors = entry.get("author", [])
+    affiliation_name, affiliation_country = first_affiliation(entry.get("affiliation", []))
+    metadata = {field: entry.get(key, "N/A") for field, key in CORE_FIELDS}
+    metadata.update({
+        "Scopus_ID": scopus_id,
+        "Authors": [author.get("authname", "N/A") for author in authors] if isinstance(authors, list) else [],
+        "Keywords": entry.get("authkeywords", "N/A"),
+        "Affiliation_Name": affiliation_name,
+        "Affiliation_Country": affiliation_country,
+        "Cited_By_Count": int(entry.get("citedby-count", 0))
+    })
+    return metadata
+
+def fetch_metadata_batch(scopus_ids, retries=3):
+    """
+    Retrieve metadata for up to METADATA_BATCH_SIZE articles with a single
+    SCOPUS_ID(a) OR SCOPUS_ID(b) ... search. IDs the search does not return
+    fall back to fetch_metadata. Results are in the same order as scopus_ids.
+    """
+    results = {}
+    missing = []
+    for scopus_id in scopus_ids:
+        cached = get_cached_metadata(scopus_id)
+        if cached is not None:
+            results[scopus_id] = cached
+        else:
+            missing.append(scopus_id)
+    if missing:
+        print(f"Fetching metadata for {len(missing)} articles...")
+        query = " OR ".join(f"SCOPUS_ID({scopus_id})" for scopus_id in missing)
+        params = {"query": query, "count": len(missing), "view": "COMPLETE"}
+        json_data = scopus_get(SEARCH_URL, params, required_key="search-results",
+                               retries=retries, description="metadata batch")
+        if json_data is not None:
+            wanted = set(missing)
+            for entry in json_data["search-results"].get("entry", []):
+                scopus_id = entry.get("dc:identifier", "").removeprefix(SCOPUS_ID_PREFIX)
+                if scopus_id in wanted:
+                    metadata = parse_search_entry(scopus_id, entry)
+                    cache_metadata(scopus_id, metadata)
+                    results[scopus_id] = metadata
+    return [results[scopus_id] if scopus_id in results else fetch_metadata(scopus_id) for scopus_id in scopus_ids]
+
+def fetch_page_metadata(scopus_ids):
+    """Fetch metadata for a page of IDs in concurrent batches; the result is in page order."""
+    batches = [scopus_ids[i:i + METADATA_BATCH_SIZE] for i in range(0, len(scopus_ids), METADATA_BATCH_SIZE)]
+    return [metadata for batch in FETCH_EXECUTOR.map(fetch_metadata_batch, batches) for metadata in batch]
 
 def fetch_citations(scopus_id, count=200, retries=3):
     """
@@ -148,63 +424,60 @@ def fetch_citations(scopus_id, count=200, retries=3):
     """
     query = f"REF({scopus_id})"
     params = {"query": query, "count": count, "start": 0, "view": "STANDARD"}
-    for attempt in range(retries):
-        response = requests.get(SEARCH_URL, headers=get_headers(), params=params)
-        if response.status_code == 429:
-            print(f"Rate limit hit for citations of {scopus_id}. Cycling API key...")
-            cycle_api_key()
-            time.sleep(2)
+    json_data = scopus_get(SEARCH_URL, params, required_key="search-results",
+                           retries=retries, description=f"citations of {scopus_id}")
+    if json_data is None:
+        return {"citations": []}
+    entries = json_data.get("search-results", {}).get("entry", [])
+    citations = []
+    seen = set()  # Overlapping result pages can repeat a citing article
+    for entry in entries:
+        citing_id = entry.get("dc:identifier", "").removeprefix(SCOPUS_ID_PREFIX)
+        if not citing_id or citing_id in seen:
             continue
-        try:
-            json_data = response.json()
-        except Exception as e:
-            print(f"Error parsing JSON for citations of {scopus_id}: {e}")
-            cycle_api_key()
-            time.sleep(2)
-            continue
-        if not json_data or "search-results" not in json_data:
-            print(f"Error: No search-results found for citations of {scopus_id}")
-            cycle_api_key()
-            time.sleep(2)
-            continue
-        entries = json_data.get("search-results", {}).get("entry", [])
-        citations = []
-        for entry in entries:
-            citing_id = entry.get("dc:identifier", "").replace("SCOPUS_ID:", "")
-            citing_url = entry.get("prism:url", "N/A")
-            cited_date = entry.get("prism:coverDate", "N/A")
-            # Extract additional fields from the entry if available:
-            citing_citation_count = entry.get("citedby-count", "N/A")
-            affiliation_info = entry.get("affiliation", {})
-            if isinstance(affiliation_info, list) and affiliation_info:
-                citing_aff_country = affiliation_info[0].get("affiliation-country", "N/A")
-            elif isinstance(affiliation_info, dict):
-                citing_aff_country = affiliation_info.get("affiliation-country", "N/A")
-            else:
-                citing_aff_country = "N/A"
-            citations.append({
-                "Citing_Article_Scopus_ID": citing_id,
-                "Citing_Article_URL": citing_url,
-                "Cited_Date": cited_date,
-                "Citing_Citation_Count": citing_citation_count,
-                "Citing_Affiliation_Country": citing_aff_country
-            })
-        return {"citations": citations}
-    return {"citations": []}
-
-def backup_data(data, backup_filename):
-    """Save a backup of data to the specified file."""
-    with open(backup_filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
-    print(f"Backup saved: {backup_filename}")
+        seen.add(citing_id)
+        citing_url = entry.get("prism:url", "N/A")
+        cited_date = entry.get("prism:coverDate", "N/A")
+        # Extract additional fields from the entry if available:
+        citing_citation_count = entry.get("citedby-count", "N/A")
+        affiliation_info = entry.get("affiliation", {})
+        if isinstance(affiliation_info, list) and affiliation_info:
+            citing_aff_country = affiliation_info[0].get("affiliation-country", "N/A")
+        elif isinstance(affiliation_info, dict):
+            citing_aff_country = affiliation_info.get("affiliation-country", "N/A")
+        else:
+            citing_aff_country = "N/A"
+        citations.append({
+            "Citing_Article_Scopus_ID": citing_id,
+            "Citing_Article_URL": citing_url,
+            "Cited_Date": cited_date,
+            "Citing_Citation_Count": citing_citation_count,
+            "Citing_Affiliation_Country": citing_aff_country
+        })
+    return {"citations": citations}
+
+def add_citations(metadata):
+    """Attach the citing articles to one article's metadata if it has been cited."""
+    if metadata:
+        if metadata["Cited_By_Count"] > 0:
+            citation_data = fetch_citations(metadata["Scopus_ID"])
+            metadata["Citations"] = citation_data["citations"]
+        else:
+            metadata["Citations"] = []
+    return metadata
+
+def append_backup(backup_file, article):
+    """Append one article to the month's JSON Lines backup."""
+    backup_file.write(orjson.dumps(article) + b"\n")
 
 # ==============================
 # 🔹 Ensure Backup Directory Structure Exists
 # ==============================
-BACKUP_INTERVAL = 500  # Reduced backup frequency to 500 articles
+BACKUP_INTERVAL = 500  # Flush the backup and report progress every 500 articles
 base_backup_dir = "data/comp/post/"
 os.makedirs(base_backup_dir, exist_ok=True)
 
+@functools.lru_cache(maxsize=None)  # Each year's folder only needs creating once
 def get_year_folder(year):
     year_folder = os.path.join(base_backup_dir, str(year))
     os.makedirs(year_folder, exist_ok=True)
@@ -213,29 +486,93 @@ def get_year_folder(year):
 # ==============================
 # 🔹 Resume from Last Backup (per month) if Available
 # ==============================
+def get_backup_path(year_dir, month):
+    return os.path.join(year_dir, f"{month}_comp_23_25.jsonl")
+
+def get_progress_path(backup_path):
+    return os.path.splitext(backup_path)[0] + ".progress"
+
+def save_progress(backup_path, offset):
+    """Record how many articles (and bytes) of the backup are safely on disk."""
+    progress_path = get_progress_path(backup_path)
+    progress = {"offset": offset, "path": backup_path, "bytes": os.path.getsize(backup_path)}
+    with open(progress_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(progress_path + ".tmp", progress_path)
+
+def load_progress(backup_path):
+    """Return the (offset, bytes) checkpoint for the backup, or (0, 0) if there is no usable one."""
+    try:
+        with open(get_progress_path(backup_path), "r", encoding="utf-8") as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if progress.get("path") != backup_path or progress.get("bytes", 0) > os.path.getsize(backup_path):
+        print(f"Ignoring stale progress file for {backup_path}")
+        return 0, 0
+    return progress["offset"], progress["bytes"]
+
+def migrate_legacy_snapshot(year_dir, month, backup_path):
+    """
+    Seed the JSON Lines backup from the newest JSON array snapshot written by
+    earlier versions of this script, so a month in progress resumes instead of
+    restarting. Returns True if a snapshot was migrated.
+    """
+    snapshots = []
+    for snapshot in glob.glob(os.path.join(year_dir, f"{month}_*_comp_23_25.json")):
+        try:
+            # Expected format: MONTH_<number>_comp_23_25.json
+            snapshots.append((int(os.path.basename(snapshot).split("_")[1]), snapshot))
+        except ValueError:
+            continue
+    if not snapshots:
+        return False
+    _, latest_snapshot = max(snapshots)
+    with open(latest_snapshot, "rb") as f:
+        articles = orjson.loads(f.read())
+    tmp_file = backup_path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.writelines(orjson.dumps(article) + b"\n" for article in articles)
+    os.replace(tmp_file, backup_path)
+    print(f"Migrated {len(articles)} articles from legacy backup {latest_snapshot}")
+    return True
+
 def resume_backup(year_dir, month):
-    backup_files = glob.glob(os.path.join(year_dir, f"{month}_*_comp_23_25.json"))
-    start_offset = 0
-    articles = []
-    if backup_files:
-        indices = []
-        for bf in backup_files:
-            base = os.path.basename(bf)
-            try:
-                # Expected format: MONTH_<number>_comp_23_25.json
-                index_val = int(base.split("_")[1])
-                indices.append(index_val)
-            except Exception as e:
-                print(f"Error extracting index from {base}: {e}")
-        if indices:
-            start_offset = max(indices)
-            latest_backup = os.path.join(year_dir, f"{month}_{start_offset}_comp_23_25.json")
-            with open(latest_backup, "r", encoding="utf-8") as f:
-                articles = json.load(f)
-            print(f"Resuming {month} from backup: {start_offset} articles processed.")
-    else:
+    """
+    Count the articles already saved in the month's JSON Lines backup.
+    Only lines written after the last .progress checkpoint are scanned (the
+    whole file if there is none), and a partially written last line is truncated away.
+    A month with only legacy JSON array snapshots is migrated first.
+    """
+    backup_path = get_backup_path(year_dir, month)
+    if not os.path.exists(backup_path) and not migrate_legacy_snapshot(year_dir, month, backup_path):
         print(f"No backup found for {month}. Starting fresh.")
-    return start_offset, articles
+        return 0
+    start_offset, complete_bytes = load_progress(backup_path)
+    with open(backup_path, "rb+") as f:
+        f.seek(complete_bytes)
+        for line in f:
+            if not line.endswith(b"\n"):
+                print(f"Dropping incomplete last record in {backup_path}")
+                break
+            start_offset += 1
+            complete_bytes += len(line)
+        f.truncate(complete_bytes)
+    print(f"Resuming {month} from backup: {start_offset} articles processed.")
+    return start_offset
+
+def write_month_output(backup_path, output_file):
+    """Stream the month's JSON Lines backup into the final JSON array file."""
+    # Write to a temporary file first so a partial output never marks the month as done
+    tmp_file = output_file + ".tmp"
+    with open(backup_path, "rb") as src, open(tmp_file, "wb") as out:
+        out.write(b"[\n")
+        for i, line in enumerate(src):
+            if i:
+                out.write(b",\n")
+            out.write(line.rstrip(b"\n"))
+        out.write(b"\n]\n")
+    os.replace(tmp_file, output_file)
 
 # ==============================
 # 🔹 Main Data Collection Loop: Month-by-Month
@@ -266,46 +603,59 @@ while current_date <= end_date:
     if check_for_pause():
         pause_and_reload()
     
-    start_offset, monthly_articles = resume_backup(year_dir, month_name)
+    start_offset = resume_backup(year_dir, month_name)
     current_offset = start_offset
     total_processed = start_offset
+    backup_path = get_backup_path(year_dir, month_name)
+    backup_file = open(backup_path, "ab")
 
     while current_offset < 5000:  # Limit to 5000 articles per month
         if check_for_pause():
             pause_and_reload()
         params = {"query": query, "count": COUNT, "start": current_offset}
-        response = requests.get(SEARCH_URL, headers=get_headers(), params=params)
+        headers = get_headers()
+        limiter = get_rate_limiter(headers["X-ELS-APIKey"])
+        limiter.wait()
+        start_time = time.monotonic()
+        try:
+            response = SESSION.get(SEARCH_URL, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Request error fetching search results: {e}")
+            time.sleep(2)
+            continue
+        if response.status_code == 429:
+            print("Rate limit hit. Backing off...")
+            handle_rate_limit(headers["X-ELS-APIKey"], limiter, response)
+            continue
+        # Error responses say nothing about how fast the key can safely go
+        if response.status_code == 200:
+            limiter.record_success(time.monotonic() - start_time)
         if response.status_code != 200:
-            print(f"API Error {response.status_code}: {response.json()}")
+            print(f"API Error {response.status_code}: {orjson.loads(response.content)}")
             break
-        data = response.json()
+        data = orjson.loads(response.content)
         entries = data.get("search-results", {}).get("entry", [])
         if not entries:
             print(f"No more articles found for {month_name} {year}.")
             break
-        for entry in entries:
-            scopus_id = entry.get("dc:identifier", "").replace("SCOPUS_ID:", "")
-            metadata = fetch_metadata(scopus_id)
+        # Fetch the page's metadata in OR-joined batches, then each cited article's
+        # citations concurrently; both steps keep page order
+        scopus_ids = [entry.get("dc:identifier", "").removeprefix(SCOPUS_ID_PREFIX) for entry in entries]
+        scopus_ids = [scopus_id for scopus_id in scopus_ids if scopus_id]
+        for metadata in FETCH_EXECUTOR.map(add_citations, fetch_page_metadata(scopus_ids)):
             if metadata:
-                metadata["Abstract"] = fetch_abstract(scopus_id)
-                if metadata["Cited_By_Count"] > 0:
-                    citation_data = fetch_citations(scopus_id)
-                    metadata["Citations"] = citation_data["citations"]
-                else:
-                    metadata["Citations"] = []
-                monthly_articles.append(metadata)
+                append_backup(backup_file, metadata)
                 total_processed += 1
                 if total_processed % BACKUP_INTERVAL == 0:
-                    backup_filename = os.path.join(year_dir, f"{month_name}_{total_processed}_comp_23_25.json")
-                    backup_data(monthly_articles, backup_filename)
+                    backup_file.flush()
+                    save_progress(backup_path, total_processed)
                     print(f"Total articles backed up for {month_name} {year}: {total_processed}")
-                    time.sleep(10)
             #time.sleep(random.uniform(1, 2))
         current_offset += COUNT
+    backup_file.close()
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(monthly_articles, f, indent=4)
-    print(f"Data saved for {month_name} {year}! Collected {len(monthly_articles)} articles.")
+    write_month_output(backup_path, output_file)
+    print(f"Data saved for {month_name} {year}! Collected {total_processed} articles.")
     
     next_month = current_date.replace(day=28) + timedelta(days=4)
     current_date = next_month.replace(day=1)